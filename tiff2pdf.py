@@ -7,13 +7,15 @@ This tool accepts .tiff and .tif field and will ignore all others
 and those that have an incorrect hex signature.
 
 This script requires these packages to be installed:
-    * PyPDF2
+    * pikepdf
     * PIL 
+    * img2pdf
 
 
 This file contains the following functions:
     * check_hex - returns true for correct hex signature and false otherwise
-    * tiff2pdf - returns string to created pdf file.
+    * _page_to_pdf - returns bytes of a single page PDF for one TIFF page.
+    * tiff_to_pdf - returns list of in-memory PDF documents for a TIFF file.
     * main - designates paths and structure for the script.
 
 -Michael Roussell
@@ -23,13 +25,39 @@ MIT License.
 """
 #!/usr/bin/env python
 
+import io
+import multiprocessing
 import os
 import sys
-import binascii
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
-from PyPDF2 import PdfFileMerger
-from PIL import Image, ImageSequence
+import img2pdf
+from PIL import Image
+
+
+# Batch input and merged output directories, relative to the working directory the script is run from.
+INPUT_PATH = os.path.join("pdf", "input")
+OUT_PATH = os.path.join("pdf", "output")
+
+# Little endian ("II*\0") and big endian ("MM\0*") TIFF file signatures.
+_TIFF_SIGS = (b"II*\x00", b"MM\x00*")
+
+# Accepted TIFF file extensions, compared in lower case.
+_TIFF_EXTS = (".tif", ".tiff")
+
+# TIFF Compression tag (259) values img2pdf embeds without decoding: only CCITT Group 4, which it wraps
+# as a /CCITTFaxDecode stream. img2pdf decodes uncompressed and JPEG-in-TIFF pages and re-encodes them
+# as /FlateDecode, larger than pillow's output, so those go through pillow.
+_IMG2PDF_COMPRESSIONS = {4}
+
+# Place img2pdf pages at 72 dpi, one point per pixel, the same scale pillow uses for every other page.
+# The Orientation tag is ignored, as on the pillow path, so all pages of a merged PDF are laid out alike.
+_IMG2PDF_LAYOUT = img2pdf.get_fixed_dpi_layout_fun((72, 72))
+_IMG2PDF_ROTATION = img2pdf.Rotation.none
+
+# Write buffer for the merged output PDF, so the many small object writes reach disk in large chunks.
+_OUT_BUFFER_SIZE = 4 * 1024 * 1024
 
 
 def check_hex(file_path: str) -> bool:
@@ -47,124 +75,155 @@ def check_hex(file_path: str) -> bool:
     Raises:
         NONE: if file is not properly signed.
     """
-    # Check OS endian style for signature checking.
-    endian = sys.byteorder
-    if endian == "little":
-        byte_sig = "b'49492a00"
+    # Read the first 4 bytes and compare against both TIFF byte order signatures.
+    with open(file_path, "rb") as f:
+        head = f.read(4)
+    if head in _TIFF_SIGS:
+        return True
     else:
-        byte_sig = "b'4d4d002a"
+        print(f"Error Code 2: File at {file_path} is not signed as TIFF.")
+        return False
 
-    # Open file, parse bytes, and check for correct file signature.
-    with open(file_path, "rb") as f:
-        hex_dump = ""
-        n = 0
-        for chunk in iter(lambda: f.read(32), b""):
-            hex_dump = hex_dump + str(binascii.hexlify(chunk))
-            n += 1
-            if n > 10:
-                break
-        if hex_dump[:10] == byte_sig:
-            return True
-        else:
-            print(f"Error Code 2: File at {file_path} is not signed as TIFF.")
-            return False
-
-
-def tiff_to_pdf(tiff_path: str) -> str:
-    """Converts TIFF file to PDF via pillow package library Image and ImageSequence objects
+
+def _page_to_pdf(tiff_path: str, index: int) -> bytes:
+    """Decodes one TIFF page to RGB and encodes it straight into a single page PDF.
+
+    Opens its own Image object since libtiff handles are not reentrant. Only the encoded page is
+    returned, so the decoded frame is released as soon as this returns.
+    """
+    pdf_buffer = io.BytesIO()
+    with Image.open(tiff_path) as image:
+        image.seek(index)
+        image.convert("RGB").save(pdf_buffer, format="PDF")
+    return pdf_buffer.getvalue()
+
+
+def tiff_to_pdf(tiff_path: str, page_workers: int = 1) -> list:
+    """Converts TIFF file to PDF via img2pdf, or pillow package library Image objects encoded per page on a thread pool
 
     Parameters:
     ----------
     tiff_path: str (required)
         A String object that represents the path to desired tiff file for conversion.
+    page_workers: int (optional)
+        Number of threads converting pages of this file, defaults to 1.
 
     Returns:
     ---------
-    pdf_path: (str)
-        A String object that represents the path to save location of pdf output file.
+    pdf_documents: (list)
+        A List of Bytes objects holding the converted PDF, kept in memory rather than written to disk.
+        One document for the whole file from img2pdf, otherwise one single page document per page.
 
     Raises:
     --------
-    KeyError:
+    Exception:
         Raised on file or file path not found.
-    OtherError:
-        File in path not TIFF file.
+    ValueError:
+        File in path does not have a .tif or .tiff extension.
     """
-    # Ceate PDF file path from TIFF file path, Raise Exception if no file found.
-    if ".tiff" in tiff_path:
-        pdf_path = tiff_path.replace(".tiff", ".pdf")
-    else:
-        pdf_path = tiff_path.replace(".tif", ".pdf")
-    
+    # Check that file has a TIFF extension.
+    ext = os.path.splitext(tiff_path)[1]
+    if ext.lower() not in _TIFF_EXTS:
+        raise ValueError(f"{tiff_path} is not a .tif or .tiff file.")
+
     # Check that file exists
     if not os.path.exists(tiff_path):
         print("Exiting with Error Code 1:")
         raise Exception(f"{tiff_path} does not find.")
 
-    # Create Image object from path
-    image = Image.open(tiff_path)
-
-    # For page in Tiff Image object, create PDF file.
-    images = []
-    for i, page in enumerate(ImageSequence.Iterator(image)):
-        page = page.convert("RGB")
-        images.append(page)
-
-    # Check if image was larger than 1 page, append to the same middle file if not.
-    if len(images) == 1:
-        images[0].save(pdf_path)
-    else:
-        images[0].save(pdf_path, save_all=True, append_images=images[1:])
-    
-    print(f"{pdf_path} created")
-    return pdf_path
+    # Read the Compression tag (259) of every page. Seeking only parses each page's tags, no pixel data
+    # is decoded.
+    compressions = set()
+    with Image.open(tiff_path) as image:
+        page_count = getattr(image, "n_frames", 1)
+        for index in range(page_count):
+            image.seek(index)
+            compressions.add(image.tag_v2.get(259))
+
+    # Embed CCITT Group 4 pages as-is with img2pdf, skipping the decode to RGB and re-encode.
+    if compressions <= _IMG2PDF_COMPRESSIONS:
+        try:
+            return [img2pdf.convert(tiff_path, layout_fun=_IMG2PDF_LAYOUT, rotation=_IMG2PDF_ROTATION)]
+        except Exception:
+            # img2pdf refuses some bit depths, color spaces, palettes and transparency, partly with bare
+            # Exception, fall back to pillow below.
+            pass
+
+    # Decode and encode every page on a thread pool, pillow releases the GIL while doing so. Pages are
+    # collected in page order and only encoded pages are held, never every decoded frame at once.
+    # Each page is still decoded in full, so peak memory is one full raster per page thread.
+    with ThreadPoolExecutor(max_workers=page_workers) as page_executor:
+        return list(page_executor.map(_page_to_pdf, [tiff_path] * page_count, range(page_count)))
 
 
 def main():
     # gather cli arguments passed from php and parse them 
-    pat_files = sys.argv
+    pat_set = frozenset(sys.argv[1:])
     pat_id = sys.argv[1].lower().replace(",", "_")
 
-    # For all TIFF files in working directory, convert to PDF and add path to a middle files list
+    # For all TIFF files in working directory, convert to an in-memory PDF document
     print("~~~> Launching TIFF to PDF Converter.")
-    middle_file_names = []
-
-    # For all tif or tiff files with correct path and in proper batch, create pdf middle file
-    current_path = os.getcwd()
-    input_path = os.path.join('pdf', 'input')
-    for file in os.listdir(input_path):
-        if (file.endswith(".tiff") or file.endswith(".tif")) and check_hex(os.path.join(input_path, file)) and file in pat_files:
-            middle_file_names.append(tiff_to_pdf(os.path.join(input_path, file)))
-        else:
-            continue
-
-    # Merge all PDF output files into output PDF file using Py2PDF PdfMerger Class object
-    merger = PdfFileMerger()
-
-    # Append  all pdf middle files to merger object.
-    for pdf in middle_file_names:
-        merger.append(pdf)
-
-    # Set date and name for output file. 
-    now = datetime.now()
-    out_path =os.path.join('pdf','output')
-    outfile_name = pat_id + "_merged_" + now.strftime("%Y_%m_%d_%H_%M_%S") + ".pdf"
-
-    # Write merged PDF middle files to outfile and close merger.
-    merger.write(os.path.join(out_path, outfile_name))
-    print(f"{outfile_name} created succesfully in output path.")
-    merger.close()
-
-    # Delete middle files.
-    for file in middle_file_names:
-            print(f"Removing {file}.")
-            os.remove(file)
-
-    # Delete origin files for this batch
-    for file in os.listdir(input_path):
-        if file in pat_files:
-            print(f"Removing {file}.")
-            os.remove(os.path.join(input_path , file))
+
+    # For all tif or tiff files with correct path and in proper batch, collect the path for conversion.
+    # Every batch file seen on this pass is remembered so the originals are deleted without a second scan.
+    valid_paths = []
+    originals_to_delete = []
+    with os.scandir(INPUT_PATH) as it:
+        for entry in it:
+            if not entry.is_file() or entry.name not in pat_set:
+                continue
+            originals_to_delete.append(entry.path)
+            if os.path.splitext(entry.name)[1].lower() in _TIFF_EXTS and check_hex(entry.path):
+                valid_paths.append(entry.path)
+
+    # Collect per-file status lines and write them once at the end instead of printing per file. The
+    # lines are written even when a conversion, the save or a delete fails part way through.
+    log_lines = []
+    try:
+        # Convert the batch in parallel, one worker process per file up to the core count. Results keep
+        # input order. Cores left over when the batch has fewer files than cores go to page threads, so
+        # processes times threads stays near the core count.
+        cpu_count = os.cpu_count() or 1
+        file_workers = max(1, min(cpu_count, len(valid_paths)))
+        page_workers = max(1, cpu_count // max(1, len(valid_paths)))
+        pdf_documents = []
+        with ProcessPoolExecutor(max_workers=file_workers) as executor:
+            results = executor.map(tiff_to_pdf, valid_paths, [page_workers] * len(valid_paths))
+            for path, documents in zip(valid_paths, results):
+                pdf_documents.extend(documents)
+                log_lines.append(f"{path} converted")
+
+        # Merge all PDF documents into one output PDF using a pikepdf Pdf object. Imported here so
+        # conversion worker processes never load it.
+        import pikepdf
+
+        merged = pikepdf.Pdf.new()
+
+        # Append pages of all in-memory PDF documents. Sources stay open until the merged file is
+        # saved, pikepdf copies their objects lazily on save.
+        sources = [pikepdf.Pdf.open(io.BytesIO(pdf_bytes)) for pdf_bytes in pdf_documents]
+        for source in sources:
+            merged.pages.extend(source.pages)
+
+        # Set date and name for output file.
+        now = datetime.now()
+        outfile_name = pat_id + "_merged_" + now.strftime("%Y_%m_%d_%H_%M_%S") + ".pdf"
+
+        # Write merged PDF documents to outfile and close all documents.
+        with open(os.path.join(OUT_PATH, outfile_name), "wb", buffering=_OUT_BUFFER_SIZE) as out_file:
+            merged.save(out_file)
+        log_lines.append(f"{outfile_name} created succesfully in output path.")
+        merged.close()
+        for source in sources:
+            source.close()
+
+        # Delete origin files for this batch
+        for path in originals_to_delete:
+            os.unlink(path)
+            log_lines.append(f"Removing {path}.")
+    finally:
+        if log_lines:
+            sys.stdout.write("\n".join(log_lines) + "\n")
 
     #  End Program.
     print("Exiting with Error Code 0:")
@@ -175,4 +234,8 @@ def main():
 Running from this file.
 """
 if __name__ == "__main__":
+    # Fork workers on Linux, so they inherit the already imported modules. Other platforms keep their
+    # default start method, fork is unsafe with macOS system frameworks.
+    if sys.platform.startswith("linux"):
+        multiprocessing.set_start_method("fork")
     main()
@@ -7,13 +7,13 @@ This tool accepts .tiff and .tif field and will ignore all others
 and those that have an incorrect hex signature/
 
 This script requires these packages to be installed:
-    * PyPDF2
+    * pikepdf
     * PIL 
 
 
 This file contains the following functions:
     * check_hex - returns true for correct hex signature and false otherwise
-    * tiff2pdf - returns string to created pdf file.
+    * tiff_to_pdf - returns list of in-memory single page PDF documents for a TIFF file.
 
 -Michael Roussell
 DCSK
@@ -21,16 +21,24 @@ MIT License.
 """
 #!/usr/bin/env python
 
+import io
+import multiprocessing
 import os
 import sys
-import binascii
 from colorama import Fore
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-from PyPDF2 import PdfFileMerger
 from PIL import Image, ImageSequence
 
 
+# Little endian ("II*\0") and big endian ("MM\0*") TIFF file signatures.
+_TIFF_SIGS = (b"II*\x00", b"MM\x00*")
+
+# Write buffer for the merged output PDF, so the many small object writes reach disk in large chunks.
+_OUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
 def check_hex(file_path: str) -> bool:
     """Checks input file via path for correct Hex file signature.
 
@@ -46,29 +54,13 @@ def check_hex(file_path: str) -> bool:
     Raises:
         None: yet
     """
-    # Check OS endian style for signature checking.
-    endian = sys.byteorder
-    if endian == "little":
-        byte_sig = "b'49492a00"
-    else:
-        byte_sig = "b'4d4d002a"
-
-    # Open file, parse bytes, and check for correct file signature.
+    # Read the first 4 bytes and compare against both TIFF byte order signatures.
     with open(file_path, "rb") as f:
-        hex_dump = ""
-        n = 0
-        for chunk in iter(lambda: f.read(32), b""):
-            hex_dump = hex_dump + str(binascii.hexlify(chunk))
-            n += 1
-            if n > 10:
-                break
-        if hex_dump[:10] == byte_sig:
-            return True
-        else:
-            return False
-
-
-def tiff_to_pdf(tiff_path: str) -> str:
+        head = f.read(4)
+    return head in _TIFF_SIGS
+
+
+def tiff_to_pdf(tiff_path: str) -> list:
     """Converts TIFF file to PDF via pillow package library Image and ImageSequence objects
 
     Parameters:
@@ -78,8 +70,8 @@ def tiff_to_pdf(tiff_path: str) -> str:
 
     Returns:
     ---------
-    pdf_path: (str)
-        A String object that represents the path to save location of pdf output file.
+    pdf_documents: (list)
+        A List of Bytes objects, one single page PDF per page, kept in memory rather than written to disk.
 
     Raises:
     --------
@@ -88,53 +80,50 @@ def tiff_to_pdf(tiff_path: str) -> str:
     OtherError:
         File in path not TIFF file.
     """
-    # Ceate PDF file path from TIFF file path, Raise Exception if no file found.
-    if ".tiff" in tiff_path:
-        pdf_path = tiff_path.replace(".tiff", ".pdf")
-    else:
-        pdf_path = tiff_path.replace(".tif", ".pdf")
-    
     # Check that file exists
     if not os.path.exists(tiff_path):
         print(Fore.RED + "Exiting with Error Code 1:")
         raise Exception(f"{tiff_path} does not find.")
 
-    # Create Image object from path
-    image = Image.open(tiff_path)
-
-    # For page in Tiff Image object, create PDF file.
-    images = []
-    for i, page in enumerate(ImageSequence.Iterator(image)):
-        page = page.convert("RGB")
-        images.append(page)
-
-    # Check if image was larger than 1 page.
-    if len(images) == 1:
-        images[0].save(pdf_path)
-    else:
-        images[0].save(pdf_path, save_all=True, append_images=images[1:])
-    return pdf_path
+    # Create Image object from path, closed once every page is converted. Each page is encoded straight
+    # into its own single page PDF, so only one decoded frame is held at a time.
+    pdf_documents = []
+    with Image.open(tiff_path) as image:
+        for page in ImageSequence.Iterator(image):
+            pdf_buffer = io.BytesIO()
+            page.convert("RGB").save(pdf_buffer, format="PDF")
+            pdf_documents.append(pdf_buffer.getvalue())
+    return pdf_documents
 
 
 def main():
-        # For all TIFF files in working directory, convert to PDF and add path to a middle files list
+        # For all TIFF files in working directory, convert to an in-memory PDF document
     print("~~~> Launching TIFF to PDF Converter.")
-    middle_file_names = []
 
     # TODO: Would need to change file path for Windows, NOTE: requires absolute path
     input_path = "input/"
-    for file in os.listdir(input_path):
-        if (file.endswith(".tiff") or file.endswith(".tif")) and check_hex(input_path + file):
-            middle_file_names.append(tiff_to_pdf(input_path + file))
-        else:
-            continue
+    valid_paths = [
+        input_path + file
+        for file in os.listdir(input_path)
+        if (file.endswith(".tiff") or file.endswith(".tif")) and check_hex(input_path + file)
+    ]
+
+    # Convert the batch in parallel, one worker process per file up to the core count. Results keep input order.
+    file_workers = max(1, min(os.cpu_count() or 1, len(valid_paths)))
+    with ProcessPoolExecutor(max_workers=file_workers) as executor:
+        pdf_documents = [document for documents in executor.map(tiff_to_pdf, valid_paths) for document in documents]
 
-    # Merge all PDF output files into output PDF file using Py2PDF PdfMerger Class object
-    merger = PdfFileMerger()
+    # Merge all PDF documents into one output PDF using a pikepdf Pdf object. Imported here so
+    # conversion worker processes never load it.
+    import pikepdf
 
-    # Append  all pdf middle files to merger object.
-    for pdf in middle_file_names:
-        merger.append(pdf)
+    merged = pikepdf.Pdf.new()
+
+    # Append pages of all in-memory PDF documents. Sources stay open until the merged file is saved,
+    # pikepdf copies their objects lazily on save.
+    sources = [pikepdf.Pdf.open(io.BytesIO(pdf_bytes)) for pdf_bytes in pdf_documents]
+    for source in sources:
+        merged.pages.extend(source.pages)
 
     # Set date and name for output file.
     # TODO: Would need to change file path for Windows, NOTE: requires absolute path
@@ -142,18 +131,16 @@ def main():
     out_path = "outputs/"
     outfile_name = "tiff2pdf_output_" + now.strftime("%Y_%m_%d_%H_%M_%S") + ".pdf"
 
-    # Write merged PDF middle files to outfile.
-    merger.write(out_path + outfile_name)
+    # Write merged PDF documents to outfile and close all documents.
+    with open(out_path + outfile_name, "wb", buffering=_OUT_BUFFER_SIZE) as out_file:
+        merged.save(out_file)
     print(Fore.CYAN + f"{outfile_name} created succesfully in original path.")
+    merged.close()
+    for source in sources:
+        source.close()
 
-    # Delete middle files.
-    for file in middle_file_names:
-        os.remove(file)
-        print(Fore.YELLOW + f"Removing {file}.")
-
-    # Close merger and End Program.
+    # End Program.
     print(Fore.GREEN + "Exiting with Error Code 0:")
-    merger.close()
     print(Fore.RESET + "~~~> Closing TIFF to PDF Converter." +   Fore.GREEN +  " Success!")
     quit()
 
@@ -161,4 +148,8 @@ def main():
 Running from this file.
 """
 if __name__ == "__main__":
+    # Fork workers on Linux, so they inherit the already imported modules. Other platforms keep their
+    # default start method, fork is unsafe with macOS system frameworks.
+    if sys.platform.startswith("linux"):
+        multiprocessing.set_start_method("fork")
     main()